@@ -1,12 +1,17 @@
-import datetime
+import asyncio
+import logging
 import os
 import re
+import secrets
+import time
 
 import dotenv
 import httpx
+import orjson
+from async_lru import alru_cache
 from azure.identity import DefaultAzureCredential
 from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from semantic_kernel import Kernel
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
@@ -14,33 +19,137 @@ from semantic_kernel.connectors.ai.prompt_execution_settings import PromptExecut
 from semantic_kernel.contents.chat_history import ChatHistory
 from semantic_kernel.functions.kernel_arguments import KernelArguments
 
+try:
+    # Linear-time matching for patterns run over whole AI responses
+    import re2 as linear_re
+except ImportError:
+    linear_re = re
+
 dotenv.load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+logger = logging.getLogger("chat")
 templates = Jinja2Templates(directory="templates")
 
 pool_management_endpoint = os.getenv("POOL_MANAGEMENT_ENDPOINT")
 azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 
+# Patterns used by extract_python_code and the /chat math detection
+SIMPLE_MATH_RES = [linear_re.compile(p) for p in (
+    r'(\d+\s*[\+\-\*\/\*\*]\s*\d+)',  # Basic math operations
+    r'(\d+\s*\*\*\s*\d+)',            # Power operations
+    r'(\d+\s*%\s*\d+)',               # Modulo operations
+)]
+# A stripped line that looks like Python: a statement keyword, an assignment,
+# an operator, or a trailing function call
+LINE_PYLIKE_RE = linear_re.compile(
+    r'^(?:import |from |def |class |if |for |while |#|result =|answer =|calc =)'
+    r'|print\(| = |\*\*| [+\-*/] |\(.*\)$'
+)
+NUMBER_RE = re.compile(r'\b\d+\b')
+# Anchored only at the start of a word so inflections ("divided", "subtraction") still match
+MATH_KEYWORDS_RE = re.compile(
+    r"\b(?:calculate|squared|square|root|solve|what is|what's|how much|percentage|percent"
+    r"|times|multiply|divide|addition|subtract|plus|minus)",
+    re.IGNORECASE
+)
+MATH_OPS_RE = re.compile(r'[+\-*/=^x×]', re.IGNORECASE)
+
+# Prompt templates for /chat; the user message goes between prefix and suffix
+ENHANCED_PROMPT_PREFIX = """You are an AI assistant that MUST use Python code execution for mathematical calculations.
+
+CRITICAL RULES:
+1. For math questions, you MUST write Python code
+2. ALWAYS format Python code using ```python code blocks
+3. Use print() statements to display results
+
+User question: \""""
+ENHANCED_PROMPT_SUFFIX = """"
+
+Provide Python code in ```python blocks that calculates and prints the answer."""
+REGULAR_PROMPT_PREFIX = """You are a helpful AI assistant. Respond naturally to the user's question.
+
+User: """
+
+# Shared credential; DefaultAzureCredential does not cache tokens across instances
+azure_credential = DefaultAzureCredential()
+
+# Shared HTTP client for the session pool API, created on startup
+HTTPX_CLIENT: httpx.AsyncClient | None = None
+
+# Sampling temperature for /chat
+CHAT_TEMPERATURE = 0.7
+
+# /chat answers are cached per message; the TTL lets a sampled answer be regenerated
+CHAT_CACHE_SIZE = 1024
+CHAT_CACHE_TTL = 300  # seconds
+
+NO_RESPONSE = "No response generated"
+
+
+@app.on_event("startup")
+async def startup():
+    """Create the shared HTTP client and chat service so they are reused across requests."""
+    global HTTPX_CLIENT
+    HTTPX_CLIENT = httpx.AsyncClient(
+        timeout=60.0,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200)
+    )
+
+    app.state.kernel = Kernel()
+    app.state.chat_service = None
+    app.state.settings = PromptExecutionSettings(
+        service_id="chat-gpt",
+        max_tokens=500,
+        temperature=CHAT_TEMPERATURE
+    )
+    try:
+        # Add Azure OpenAI chat completion service
+        app.state.chat_service = AzureChatCompletion(
+            service_id="chat-gpt",
+            ad_token_provider=auth_callback_factory("https://cognitiveservices.azure.com/.default"),
+            endpoint=azure_openai_endpoint,
+            deployment_name="gpt-35-turbo",
+        )
+        app.state.kernel.add_service(app.state.chat_service)
+    except Exception as e:
+        # Keep the UI and health endpoints up; /chat reports the problem
+        logger.warning("Failed to create Azure OpenAI chat service: %s", e)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the shared HTTP client."""
+    if HTTPX_CLIENT is not None:
+        await HTTPX_CLIENT.aclose()
+
 def auth_callback_factory(scope):
     auth_token = None
+    # Only one coroutine refreshes an expired token; the rest wait and reuse it
+    refresh_lock = asyncio.Lock()
 
     async def auth_callback() -> str:
         """Auth callback for authentication with Azure services.
         This uses Azure's DefaultAzureCredential to get an access token.
         """
         nonlocal auth_token
-        current_utc_timestamp = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+        current_utc_timestamp = int(time.time())
 
         if not auth_token or auth_token.expires_on < current_utc_timestamp:
-            credential = DefaultAzureCredential()
-            auth_token = credential.get_token(scope)
+            async with refresh_lock:
+                if not auth_token or auth_token.expires_on < current_utc_timestamp:
+                    # get_token is blocking (IMDS/CLI), so keep it off the event loop
+                    auth_token = await asyncio.to_thread(azure_credential.get_token, scope)
 
         return auth_token.token
     
     return auth_callback
 
 
+_sessions_auth = auth_callback_factory("https://dynamicsessions.io/.default")
+
+
 async def execute_python_code(code: str) -> dict:
     """Execute Python code using Azure Container Apps Session Pool via HTTP API."""
     if not pool_management_endpoint:
@@ -51,13 +160,11 @@ async def execute_python_code(code: str) -> dict:
         }
     
     try:
-        # Get authentication token with correct scope
-        credential = DefaultAzureCredential()
-        token = credential.get_token("https://dynamicsessions.io/.default")
+        # Get (cached) authentication token with correct scope
+        token_str = await _sessions_auth()
         
-        # Generate a session identifier (use timestamp for uniqueness)
-        import uuid
-        session_id = f"session-{uuid.uuid4().hex[:8]}"
+        # Generate a random session identifier (only 32 bits are used)
+        session_id = f"session-{secrets.token_hex(4)}"
         
         # Create session payload for code execution
         session_payload = {
@@ -69,37 +176,35 @@ async def execute_python_code(code: str) -> dict:
         }
         
         headers = {
-            "Authorization": f"Bearer {token.token}",
+            "Authorization": f"Bearer {token_str}",
             "Content-Type": "application/json"
         }
         
+        # Build the full URL for code execution
+        execute_url = f"{pool_management_endpoint}/code/execute?api-version=2024-02-02-preview&identifier={session_id}"
+        
         # Execute code via session pool API
-        async with httpx.AsyncClient() as client:
-            # Build the full URL for code execution
-            execute_url = f"{pool_management_endpoint}/code/execute?api-version=2024-02-02-preview&identifier={session_id}"
-            
-            response = await client.post(
-                execute_url,
-                json=session_payload,
-                headers=headers,
-                timeout=60.0
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "output": result.get("properties", {}).get("stdout", ""),
-                    "error": result.get("properties", {}).get("stderr", ""),
-                    "result": result,
-                    "session_id": session_id
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"HTTP {response.status_code}: {response.text}",
-                    "output": ""
-                }
+        response = await HTTPX_CLIENT.post(
+            execute_url,
+            json=session_payload,
+            headers=headers
+        )
+        
+        if response.status_code == 200:
+            result = orjson.loads(response.content)
+            return {
+                "success": True,
+                "output": result.get("properties", {}).get("stdout", ""),
+                "error": result.get("properties", {}).get("stderr", ""),
+                "result": result,
+                "session_id": session_id
+            }
+        else:
+            return {
+                "success": False,
+                "error": f"HTTP {response.status_code}: {response.text}",
+                "output": ""
+            }
         
     except Exception as e:
         return {
@@ -109,38 +214,53 @@ async def execute_python_code(code: str) -> dict:
         }
 
 
+def _next_fence(text: str, start: int) -> int:
+    """Index of the next ``` at the start of a line, or -1; other backticks are skipped."""
+    i = text.find('```', start)
+    while i > 0 and text[i - 1] != '\n':
+        i = text.find('```', i + 3)
+    return i
+
+
+def _find_fence(text: str) -> str:
+    """Find the first fenced code block with a linear scan (no regex backtracking).
+
+    Only ``` at the start of a line opens or closes a block. A block tagged
+    ```python wins over an untagged ``` block; blocks tagged with any other
+    language are ignored.
+    """
+    untagged = None
+    i = _next_fence(text, 0)
+    while i >= 0:
+        j = text.find('\n', i)
+        if j < 0:
+            break
+        k = _next_fence(text, j + 1)
+        if k < 0:
+            break
+        lang = text[i + 3:j].strip()
+        if lang == 'python':
+            return text[j + 1:k].strip()
+        if not lang and untagged is None:
+            untagged = text[j + 1:k].strip()
+        i = _next_fence(text, k + 3)
+    return untagged or ''
+
+
 def extract_python_code(text: str) -> str:
     """Extract Python code from AI response."""
-    # Look for code blocks marked with ```python
-    python_code_pattern = r'```python\n(.*?)\n```'
-    matches = re.findall(python_code_pattern, text, re.DOTALL)
-    
-    if matches:
-        return matches[0].strip()
-    
-    # Look for code blocks marked with ```
-    code_pattern = r'```\n(.*?)\n```'
-    matches = re.findall(code_pattern, text, re.DOTALL)
+    # Look for code blocks marked with ```python, then plain ```
+    code = _find_fence(text)
     
-    if matches:
-        return matches[0].strip()
+    if code:
+        return code
     
     # AGGRESSIVE: Check if the entire response looks like Python code
-    lines = text.split('\n')
-    python_lines = []
-    
-    # More aggressive detection for math/calculation responses
-    for line in lines:
-        stripped = line.strip()
-        if stripped and not stripped.startswith('---'):  # Ignore separators
-            # Check if line contains Python-like patterns
-            if (stripped.startswith(('print(', 'import ', 'from ', 'def ', 'class ', 'if ', 'for ', 'while ', '#', 'result =', 'answer =', 'calc =')) or
-                'print(' in stripped or 
-                ' = ' in stripped and not stripped.startswith('#') or
-                '**' in stripped or  # Power operator
-                ' + ' in stripped or ' - ' in stripped or ' * ' in stripped or ' / ' in stripped or
-                stripped.endswith(')') and ('(' in stripped)):  # Function calls
-                python_lines.append(line)
+    # More aggressive detection for math/calculation responses (separators are ignored)
+    python_lines = [
+        line for line in text.split('\n')
+        if (stripped := line.strip()) and not stripped.startswith('---') and LINE_PYLIKE_RE.search(stripped)
+    ]
     
     # If we found a significant amount of Python-like content, return it
     if python_lines and len(python_lines) >= 1:
@@ -148,14 +268,8 @@ def extract_python_code(text: str) -> str:
     
     # FALLBACK: For simple math expressions, create Python code
     # Look for simple math patterns and convert them
-    simple_math_patterns = [
-        r'(\d+\s*[\+\-\*\/\*\*]\s*\d+)',  # Basic math operations
-        r'(\d+\s*\*\*\s*\d+)',            # Power operations
-        r'(\d+\s*%\s*\d+)',               # Modulo operations
-    ]
-    
-    for pattern in simple_math_patterns:
-        matches = re.findall(pattern, text)
+    for pattern in SIMPLE_MATH_RES:
+        matches = pattern.findall(text)
         if matches:
             # Convert to Python code
             return f"result = {matches[0]}\nprint(result)"
@@ -168,10 +282,18 @@ async def root():
     """Redirect to the chat UI"""
     return RedirectResponse("/ui")
 
+# Static bodies for the monitoring endpoints; the HTTP Date header carries the time
+_HEALTH_BYTES = b'{"status":"healthy"}'
+_DEBUG_BYTES = orjson.dumps({
+    "pool_endpoint": pool_management_endpoint,
+    "azure_openai_endpoint": azure_openai_endpoint,
+    "has_credentials": bool(pool_management_endpoint and azure_openai_endpoint)
+})
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.datetime.now().isoformat()}
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 @app.get("/ui", response_class=HTMLResponse)
 async def chat_ui(request: Request):
@@ -182,144 +304,139 @@ async def chat_ui(request: Request):
 @app.get("/debug")
 async def debug_info():
     """Debug endpoint to check environment variables."""
-    return {
-        "pool_endpoint": pool_management_endpoint,
-        "azure_openai_endpoint": azure_openai_endpoint,
-        "has_credentials": bool(pool_management_endpoint and azure_openai_endpoint)
-    }
-
-
-@app.get("/chat")
-async def chat(message: str):
-    """
-    Chat endpoint that processes user messages using Semantic Kernel and Azure Session Pools.
-    Can execute Python code for calculations and programming tasks.
-    """
-    print(f"DEBUG: Received message: {message}")
-    print(f"DEBUG: Pool endpoint configured: {pool_management_endpoint}")
-    
-    kernel = Kernel()
+    return Response(content=_DEBUG_BYTES, media_type="application/json")
 
-    # Add Azure OpenAI chat completion service
-    chat_service = AzureChatCompletion(
-        service_id="chat-gpt",
-        ad_token_provider=auth_callback_factory("https://cognitiveservices.azure.com/.default"),
-        endpoint=azure_openai_endpoint,
-        deployment_name="gpt-35-turbo",
-    )
-    kernel.add_service(chat_service)
 
+def build_chat_history(message: str, debug_enabled: bool) -> tuple[ChatHistory, bool]:
+    """Build the prompt for a message; returns the chat history and whether it is a math question."""
     # Create a chat history with the user's message
     chat_history = ChatHistory()
     
     # Smart detection for math/calculation questions
-    math_keywords = ['calculate', 'squared', 'square', 'root', 'solve', 'what is', 'what\'s', 'how much', 
-                     'percentage', 'percent', 'times', 'multiply', 'divide', 'addition', 'subtract', 'plus', 'minus']
-    math_operators = ['+', '-', '*', '/', '=', '^', '**', 'x', ' x ', '×']
-    number_pattern = r'\b\d+\b'
-    
-    message_lower = message.lower()
-    has_math_keywords = any(keyword in message_lower for keyword in math_keywords)
-    has_math_operators = any(op in message_lower for op in math_operators)
-    has_numbers = bool(re.search(number_pattern, message))
-    
-    # Enhanced detection: if it has numbers and math operators, or numbers and math keywords
-    is_math_question = (has_numbers and has_math_operators) or (has_math_keywords and has_numbers)
+    # Both conditions require numbers, so skip the other scans when there are none
+    has_numbers = bool(NUMBER_RE.search(message))
+    if not has_numbers:
+        has_math_keywords = has_math_operators = False
+        is_math_question = False
+    else:
+        has_math_keywords = bool(MATH_KEYWORDS_RE.search(message))
+        has_math_operators = bool(MATH_OPS_RE.search(message))
+        # Enhanced detection: numbers and math operators, or numbers and math keywords
+        is_math_question = has_math_operators or has_math_keywords
     
     # Debug logging for math detection
-    print(f"DEBUG: Math detection for '{message}':")
-    print(f"DEBUG: has_math_keywords={has_math_keywords}, has_math_operators={has_math_operators}, has_numbers={has_numbers}")
-    print(f"DEBUG: is_math_question={is_math_question}")
+    if debug_enabled:
+        logger.debug("Math detection for '%s':", message)
+        logger.debug("has_math_keywords=%s, has_math_operators=%s, has_numbers=%s",
+                     has_math_keywords, has_math_operators, has_numbers)
+        logger.debug("is_math_question=%s", is_math_question)
     
     if is_math_question:
         # Enhanced prompt for code generation
-        enhanced_prompt = f"""You are an AI assistant that MUST use Python code execution for mathematical calculations.
-
-CRITICAL RULES:
-1. For math questions, you MUST write Python code
-2. ALWAYS format Python code using ```python code blocks
-3. Use print() statements to display results
-
-User question: "{message}"
-
-Provide Python code in ```python blocks that calculates and prints the answer."""
-        chat_history.add_user_message(enhanced_prompt)
+        chat_history.add_user_message(ENHANCED_PROMPT_PREFIX + message + ENHANCED_PROMPT_SUFFIX)
     else:
         # Regular conversation prompt
-        regular_prompt = f"""You are a helpful AI assistant. Respond naturally to the user's question.
+        chat_history.add_user_message(REGULAR_PROMPT_PREFIX + message)
+    
+    return chat_history, is_math_question
+
 
-User: {message}"""
-        chat_history.add_user_message(regular_prompt)
+async def answer_message(message: str, debug_enabled: bool = False) -> dict:
+    """
+    Answer a chat message, executing any generated Python code for math questions.
+    With debug_enabled the response also carries debug_* fields.
+    """
+    chat_history, is_math_question = build_chat_history(message, debug_enabled)
     
-    try:
-        # Create proper execution settings
-        settings = PromptExecutionSettings(
-            service_id="chat-gpt",
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        # Get response from Azure OpenAI
-        response = await chat_service.get_chat_message_contents(
-            chat_history=chat_history,
-            settings=settings,
-            kernel=kernel,
-            arguments=KernelArguments()
-        )
-        
-        ai_response = str(response[0].content) if response and len(response) > 0 else "No response generated"
-        
-        # Check if the AI response contains Python code
-        python_code = extract_python_code(ai_response)
-        
-        # Debug logging
-        print(f"DEBUG: AI response length: {len(ai_response)}")
-        print(f"DEBUG: Extracted Python code: {python_code}")
-        print(f"DEBUG: Pool endpoint: {pool_management_endpoint}")
-        
-        result = {
+    if app.state.chat_service is None:
+        raise RuntimeError("Azure OpenAI chat service is not configured")
+    
+    # Get response from Azure OpenAI
+    response = await app.state.chat_service.get_chat_message_contents(
+        chat_history=chat_history,
+        settings=app.state.settings,
+        kernel=app.state.kernel,
+        arguments=KernelArguments()
+    )
+    
+    ai_response = str(response[0].content) if response and response[0].content else NO_RESPONSE
+    
+    # Check if the AI response contains Python code
+    python_code = extract_python_code(ai_response)
+    
+    # Debug logging
+    if debug_enabled:
+        logger.debug("AI response length: %d", len(ai_response))
+        logger.debug("Extracted Python code: %s", python_code)
+        logger.debug("Pool endpoint: %s", pool_management_endpoint)
+    
+    note = "Response from Azure OpenAI via Semantic Kernel"
+    extra = {}
+    
+    # If there's Python code AND it's a math question, execute it using session pools
+    if python_code and pool_management_endpoint and is_math_question:
+        try:
+            execution_result = await execute_python_code(python_code)
+            
+            if execution_result["success"]:
+                note = "AI response with Python code executed in Azure Session Pool"
+                extra = {
+                    "code_executed": python_code,
+                    "execution_output": execution_result["output"],
+                    "execution_error": execution_result["error"] if execution_result["error"] else None,
+                    "session_id": execution_result.get("session_id", "unknown")
+                }
+            else:
+                note = "AI response with Python code (execution failed)"
+                extra = {
+                    "code_extracted": python_code,
+                    "execution_failed": execution_result["error"]
+                }
+                if debug_enabled:
+                    extra["debug_execution_result"] = execution_result
+        except Exception as e:
+            note = "AI response with Python code (execution error)"
+            extra = {
+                "code_extracted": python_code,
+                "execution_exception": str(e)
+            }
+    elif python_code:
+        note = f"AI response with Python code (session pool {'not configured' if not pool_management_endpoint else 'available'})"
+        extra = {"code_extracted": python_code}
+    
+    if debug_enabled:
+        return {
             "output": ai_response,
-            "note": "Response from Azure OpenAI via Semantic Kernel",
+            "note": note,
             "debug_extracted_code": python_code if python_code else "No Python code detected",
             "debug_pool_endpoint": pool_management_endpoint if pool_management_endpoint else "No pool endpoint configured",
             "debug_ai_response_length": len(ai_response),
-            "debug_contains_code_blocks": "```python" in ai_response or "```" in ai_response
+            "debug_contains_code_blocks": "```python" in ai_response or "```" in ai_response,
+            **extra
         }
-        
-        # If there's Python code AND it's a math question, execute it using session pools
-        if python_code and pool_management_endpoint and is_math_question:
-            try:
-                execution_result = await execute_python_code(python_code)
-                
-                if execution_result["success"]:
-                    result.update({
-                        "code_executed": python_code,
-                        "execution_output": execution_result["output"],
-                        "execution_error": execution_result["error"] if execution_result["error"] else None,
-                        "session_id": execution_result.get("session_id", "unknown"),
-                        "note": "AI response with Python code executed in Azure Session Pool"
-                    })
-                else:
-                    result.update({
-                        "code_extracted": python_code,
-                        "execution_failed": execution_result["error"],
-                        "note": "AI response with Python code (execution failed)",
-                        "debug_execution_result": execution_result
-                    })
-            except Exception as e:
-                result.update({
-                    "code_extracted": python_code,
-                    "execution_exception": str(e),
-                    "note": "AI response with Python code (execution error)"
-                })
-        elif python_code:
-            result.update({
-                "code_extracted": python_code,
-                "note": f"AI response with Python code (session pool {'not configured' if not pool_management_endpoint else 'available'})"
-            })
-        
-        return result
-        
+    return {"output": ai_response, "note": note, **extra}
+
+
+# Cached per message for non-debug requests only, so a cached response never
+# depends on the log level at the time it was filled. Exceptions are not cached.
+cached_answer_message = alru_cache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL)(answer_message)
+
+
+@app.get("/chat")
+async def chat(message: str):
+    """
+    Chat endpoint that processes user messages using Semantic Kernel and Azure Session Pools.
+    Can execute Python code for calculations and programming tasks.
+    """
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        logger.debug("Received message: %s", message)
+        logger.debug("Pool endpoint configured: %s", pool_management_endpoint)
+    
+    try:
+        if debug_enabled:
+            return await answer_message(message, debug_enabled=True)
+        result = await cached_answer_message(message)
     except Exception as e:
         return {
             "output": f"Error: {str(e)}",
@@ -330,4 +447,123 @@ User: {message}"""
                 "pool_endpoint": pool_management_endpoint
             }
         }
+    
+    # Don't keep empty answers or failed executions in the cache so the next request retries them
+    if result["output"] == NO_RESPONSE or "execution_failed" in result or "execution_exception" in result:
+        cached_answer_message.cache_invalidate(message)
+    
+    return result
+
+
+class _PythonFenceScanner:
+    """Find the first closed ```python block in streamed text, scanning each line once.
+
+    Fences follow the same rules as _find_fence: only ``` at the start of a
+    line counts.
+    """
+
+    def __init__(self):
+        self.pos = 0  # start of the first line not yet scanned
+        self.lang = None  # language tag of the open block, None outside a block
+        self.body_start = 0
+
+    def feed(self, text: str) -> str:
+        """Scan the text received so far; return the code once a ```python block closes, else ''."""
+        while True:
+            end = text.find('\n', self.pos)
+            if end < 0:
+                # A closing fence doesn't need to wait for its newline
+                if self.lang == 'python' and text.startswith('```', self.pos):
+                    return text[self.body_start:self.pos].strip()
+                return ''
+            if text.startswith('```', self.pos):
+                if self.lang is None:
+                    self.lang = text[self.pos + 3:end].strip()
+                    self.body_start = end + 1
+                elif self.lang == 'python':
+                    return text[self.body_start:self.pos].strip()
+                else:
+                    self.lang = None
+            self.pos = end + 1
+
+
+def _sse(payload: dict) -> bytes:
+    """Encode a payload as a server-sent event."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+@app.get("/chat/stream")
+async def chat_stream(message: str):
+    """
+    Streaming variant of /chat that sends the AI response as server-sent events.
+    Generated Python code starts executing as soon as its code block is complete.
+    """
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        logger.debug("Received streaming message: %s", message)
+    chat_history, is_math_question = build_chat_history(message, debug_enabled)
+    
+    async def events():
+        if app.state.chat_service is None:
+            yield _sse({"type": "error", "error": "Azure OpenAI chat service is not configured"})
+            return
+        
+        execute = bool(pool_management_endpoint and is_math_question)
+        python_code = ""
+        execution_task = None
+        ai_response = ""
+        scanner = _PythonFenceScanner()
+        try:
+            async for messages in app.state.chat_service.get_streaming_chat_message_contents(
+                chat_history=chat_history,
+                settings=app.state.settings,
+                kernel=app.state.kernel,
+                arguments=KernelArguments()
+            ):
+                content = messages[0].content if messages else None
+                if not content:
+                    continue
+                ai_response += content
+                yield _sse({"type": "token", "content": content})
+                
+                # Start executing as soon as a ```python block has been closed
+                if execute and execution_task is None:
+                    python_code = scanner.feed(ai_response)
+                    if python_code:
+                        execution_task = asyncio.create_task(execute_python_code(python_code))
+            
+            ai_response = ai_response or NO_RESPONSE
+            if not python_code:
+                python_code = extract_python_code(ai_response)
+                if execute and python_code:
+                    execution_task = asyncio.create_task(execute_python_code(python_code))
+            
+            if execution_task is not None:
+                execution_result = await execution_task
+                if execution_result["success"]:
+                    yield _sse({
+                        "type": "execution",
+                        "code_executed": python_code,
+                        "execution_output": execution_result["output"],
+                        "execution_error": execution_result["error"] if execution_result["error"] else None,
+                        "session_id": execution_result.get("session_id", "unknown")
+                    })
+                else:
+                    yield _sse({
+                        "type": "execution",
+                        "code_extracted": python_code,
+                        "execution_failed": execution_result["error"]
+                    })
+            elif python_code:
+                yield _sse({"type": "code", "code_extracted": python_code})
+            
+            yield _sse({"type": "done"})
+        except Exception as e:
+            yield _sse({"type": "error", "error": str(e)})
+        finally:
+            # The client may have disconnected mid-stream
+            if execution_task is not None and not execution_task.done():
+                execution_task.cancel()
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
 # Debug build 09/03/2025 20:04:55